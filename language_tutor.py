@@ -4,6 +4,14 @@ import time
 from datetime import datetime
 import os
 import textwrap
+import queue
+import threading
+import itertools
+import math
+import re
+import unicodedata
+import uuid
+import bisect
 
 # ==================== Anthropic 설정 ====================
 try:
@@ -12,6 +20,7 @@ except Exception:
     Anthropic = None
 
 ANTHROPIC_MODEL = os.getenv("ANTHROPIC_MODEL", "claude-3-5-sonnet-latest")
+TUTOR_DATA_DIR = os.getenv("TUTOR_DATA_DIR", os.path.join(os.path.expanduser("~"), ".language_tutor"))
 
 def _get_anthropic_client():
     if Anthropic is None:
@@ -21,18 +30,39 @@ def _get_anthropic_client():
         raise RuntimeError("환경변수 ANTHROPIC_API_KEY 미설정")
     return Anthropic(api_key=api_key)
 
-def _claude(messages, system, max_tokens=800, temperature=0):
+class TurnCancelled(Exception):
+    """언어 변경·대화 삭제 등으로 취소된 호출."""
+
+def _claude(messages, system, max_tokens=800, temperature=0, cancel=None):
+    # cancel: 호출 중 취소 여부를 돌려주는 함수. 지정 시 스트리밍으로 받다가 취소되면 연결을 끊는다.
+    if cancel is not None and cancel():
+        raise TurnCancelled()
     client = _get_anthropic_client()
-    resp = client.messages.create(
+    if cancel is None:
+        resp = client.messages.create(
+            model=ANTHROPIC_MODEL,
+            system=system,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+        )
+        if not resp or not getattr(resp, "content", None):
+            return ""
+        return "".join([blk.text for blk in resp.content if hasattr(blk, "text")])
+
+    parts = []
+    with client.messages.stream(
         model=ANTHROPIC_MODEL,
         system=system,
         messages=messages,
         max_tokens=max_tokens,
         temperature=temperature,
-    )
-    if not resp or not getattr(resp, "content", None):
-        return ""
-    return "".join([blk.text for blk in resp.content if hasattr(blk, "text")])
+    ) as stream:
+        for text in stream.text_stream:
+            if cancel():
+                raise TurnCancelled()
+            parts.append(text)
+    return "".join(parts)
 
 # 페이지 설정
 st.set_page_config(
@@ -68,6 +98,7 @@ st.markdown("""
         margin: 0.5rem 0; margin-left: auto; max-width: 70%; text-align: left; float: right; clear: both;
         box-shadow: 0 1px 2px rgba(0,0,0,0.1); word-wrap: break-word; font-size: 0.9375rem; line-height: 1.4; white-space: pre-wrap;
     }
+    .user-message.pending { opacity: 0.6; }
     /* 튜터 말풍선 — 여백/패딩 더 축소 */
     .assistant-message {
         background: #fff; color: #000; padding: 0.2rem 0.2rem !important; border-radius: 0.375rem;
@@ -211,14 +242,646 @@ st.markdown("""
 if 'messages' not in st.session_state: st.session_state.messages = []
 if 'selected_language' not in st.session_state: st.session_state.selected_language = 'chinese'
 if 'proficiency_level' not in st.session_state: st.session_state.proficiency_level = 'intermediate'
-if 'detailed_analysis' not in st.session_state: st.session_state.detailed_analysis = None
 if 'show_translation' not in st.session_state: st.session_state.show_translation = {}
-if 'show_analysis' not in st.session_state: st.session_state.show_analysis = True
-if 'is_loading' not in st.session_state: st.session_state.is_loading = False
+if 'show_analysis' not in st.session_state: st.session_state.show_analysis = False  # 상세 분석 패널 펼침 여부
+if 'turn_worker' not in st.session_state: st.session_state.turn_worker = None  # 백그라운드 턴 워커(첫 전송 시 생성)
+if 'analysis_queue' not in st.session_state: st.session_state.analysis_queue = None  # 상세 분석 작업 큐(첫 전송 시 생성)
+if 'analyses' not in st.session_state: st.session_state.analyses = {}  # turn_id -> {state, analysis, error}
+if 'turn_status' not in st.session_state: st.session_state.turn_status = {'state': 'idle', 'pending': [], 'analyzing': False}
 if 'translating_message_id' not in st.session_state: st.session_state.translating_message_id = None
 if 'goals' not in st.session_state: st.session_state.goals = []
 if 'input_key' not in st.session_state: st.session_state.input_key = 0
 if 'user_name' not in st.session_state: st.session_state.user_name = None  # 대화명 저장
+if 'progress' not in st.session_state: st.session_state.progress = None  # 학습 진도 누적 집계(_new_progress)
+if 'search_index' not in st.session_state: st.session_state.search_index = None  # 대화 검색 역색인(첫 색인 시 생성)
+if 'conversation_id' not in st.session_state: st.session_state.conversation_id = uuid.uuid4().hex  # 검색 인덱스 문서 키
+if 'conversation_ids' not in st.session_state: st.session_state.conversation_ids = [st.session_state.conversation_id]
+if 'learner_id' not in st.session_state:
+    # 학습자 어휘 인덱스 키. URL(?learner=...)에 남겨 새로고침·북마크로 다시 들어와도 같은 학습자로 본다
+    _learner = st.query_params.get('learner', '')
+    st.session_state.learner_id = _learner if re.fullmatch(r'[0-9a-f]{32}', _learner) else uuid.uuid4().hex
+    st.query_params['learner'] = st.session_state.learner_id
+
+# ==================== 검색 인덱스 ====================
+# 한자·가나는 문자 unigram + bigram(了·吗 같은 한 글자 검색용), 그 외(유럽어·한국어)는 단어 단위로 색인
+_CJK_RUN_RE = re.compile(r'([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+)')
+_WORD_RUN_RE = re.compile(r'[^\W_]+')
+SEARCH_MAX_HITS = 20
+
+def _search_tokens(text: str):
+    tokens = []
+    text = unicodedata.normalize('NFKC', text or "").casefold()
+    for run in _WORD_RUN_RE.findall(text):
+        for i, part in enumerate(_CJK_RUN_RE.split(run)):
+            if not part:
+                continue
+            if i % 2 == 0:
+                tokens.append(part)
+            else:
+                tokens.extend(part)
+                tokens.extend(part[j:j + 2] for j in range(len(part) - 1))
+    return tokens
+
+class SearchIndex:
+    """메시지·번역·어휘 역색인. 세션마다 하나를 두고 메시지 추가 시 증분 갱신."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._docs = []        # doc_id -> {conversation, position, field, text}
+        self._postings = {}    # term -> {conversation -> {doc_id: tf}}
+        self._df = {}          # term -> 문서 수
+
+    def add(self, conversation, position, field, text):
+        tokens = _search_tokens(text)
+        if not tokens:
+            return
+        tf = {}
+        for t in tokens:
+            tf[t] = tf.get(t, 0) + 1
+        with self._lock:
+            doc_id = len(self._docs)
+            self._docs.append({'conversation': conversation, 'position': position, 'field': field, 'text': text})
+            for t, n in tf.items():
+                self._postings.setdefault(t, {}).setdefault(conversation, {})[doc_id] = n
+                self._df[t] = self._df.get(t, 0) + 1
+
+    def search(self, query, conversations, limit=SEARCH_MAX_HITS):
+        """conversations 범위에서 query를 찾아 (일치 토큰 수, tf-idf) 순으로 반환."""
+        terms = set(_search_tokens(query))
+        if not terms:
+            return []
+        with self._lock:
+            n_docs = len(self._docs)
+            scores = {}
+            for t in terms:
+                by_conv = self._postings.get(t)
+                if not by_conv:
+                    continue
+                idf = math.log(1 + n_docs / self._df[t])
+                for conv in conversations:
+                    for doc_id, n in by_conv.get(conv, {}).items():
+                        matched, score = scores.get(doc_id, (0, 0.0))
+                        scores[doc_id] = (matched + 1, score + (1 + math.log(n)) * idf)
+            ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+            return [dict(self._docs[doc_id], matched=m, score=sc, total=len(terms)) for doc_id, (m, sc) in ranked]
+
+def _get_search_index():
+    # 세션 상태에 두어 세션이 끝나면 함께 정리된다
+    if st.session_state.search_index is None:
+        st.session_state.search_index = SearchIndex()
+    return st.session_state.search_index
+
+def _index_text(position, field, text):
+    _get_search_index().add(st.session_state.conversation_id, position, field, text)
+
+def _index_vocabulary(position, analysis):
+    for v in (analysis or {}).get('vocabulary', []):
+        if isinstance(v, dict) and v.get('word'):
+            _index_text(position, 'vocabulary', f"{v['word']} {v.get('pinyin','')} {v.get('meaning_ko','')}")
+
+def _new_conversation():
+    """대화를 비울 때 새 대화 ID를 발급 (이전 대화는 검색 결과에 남음)."""
+    st.session_state.conversation_id = uuid.uuid4().hex
+    st.session_state.conversation_ids.append(st.session_state.conversation_id)
+
+# ==================== 학습 진도 집계 ====================
+# 교정 사유(reason_ko) 키워드 → 오류 유형. 먼저 일치한 유형으로 분류
+# (교정 문장 자체는 보지 않음: 了·过·着 등은 거의 모든 중국어 문장에 들어 있다)
+ERROR_CATEGORIES = [
+    ('어순', ('어순', '语序', '순서', '위치')),
+    ('양사', ('양사', '量词')),
+    ('了·过·着', ('了', '过', '着', '동태', '완료')),
+    ('성조·발음', ('성조', '발음', '병음')),
+    ('문장 구조', ('把', '被', '보어', '구조', '문형')),
+    ('단어 선택', ('단어', '어휘', '의미', '선택', '뉘앙스')),
+    ('문법 일반', ('문법', '조사', '시제')),
+]
+_HSK_LEVEL_RE = re.compile(r'[1-9]')
+_GOAL_HSK_RE = re.compile(r'HSK\s*([1-9])', re.IGNORECASE)
+_GOAL_STOPWORDS = {'학습', '이해', '마스터', '필수', '활용', '표현', '기초', '확장'}
+
+def _new_progress():
+    return {
+        'turns': 0,
+        'errors': {},        # 오류 유형 -> 횟수
+        'hsk': {},           # HSK 급수 -> 처음 본 단어 수
+        'words': {},         # 단어 -> 등장 횟수
+        'new_words': 0,
+        'repeated_words': 0,
+        'goal_hits': {},     # 목표 -> 관련 턴 수
+    }
+
+def _error_category(correction):
+    text = str(correction.get('reason_ko') or "")
+    for name, keywords in ERROR_CATEGORIES:
+        if any(k in text for k in keywords):
+            return name
+    return '기타'
+
+def _hsk_level(raw):
+    m = _HSK_LEVEL_RE.search(str(raw or ""))
+    return m.group(0) if m else '?'
+
+def _goal_keywords(goal):
+    return [w for w in re.findall(r'[^\W_]{2,}', goal) if w not in _GOAL_STOPWORDS and not w.upper().startswith('HSK')]
+
+def _fold_turn_progress(progress, analysis, goals):
+    """한 턴의 분석(어휘)과 피드백(교정)을 누적 집계에 반영. 이전 기록은 다시 보지 않는다."""
+    progress['turns'] += 1
+    feedback = analysis.get('feedback') or {}
+    corrections = feedback.get('corrections') if isinstance(feedback, dict) else None
+    for c in corrections or []:
+        if isinstance(c, dict):
+            cat = _error_category(c)
+            progress['errors'][cat] = progress['errors'].get(cat, 0) + 1
+
+    for v in analysis.get('vocabulary', []):
+        word = v.get('word')
+        if not word:
+            continue
+        seen = progress['words'].get(word, 0)
+        progress['words'][word] = seen + 1
+        # known=True: 이전 세션에서 이미 숙지한 단어(캐시 노트)이므로 새 단어·HSK 집계에 넣지 않음
+        if seen or v.get('known'):
+            progress['repeated_words'] += 1
+        else:
+            progress['new_words'] += 1
+            level = _hsk_level(v.get('hsk_level'))
+            progress['hsk'][level] = progress['hsk'].get(level, 0) + 1
+
+    # 목표별 관련 턴: 목표 키워드가 이번 턴의 문법 항목 제목·패턴에 등장하면 1회
+    # (설명문에는 '문장', '구조' 같은 일반 명사가 거의 매번 들어가므로 보지 않음)
+    turn_text = " ".join(f"{g.get('title','')} {g.get('pattern','')}" for g in analysis.get('grammar', []))
+    for goal in goals:
+        if _GOAL_HSK_RE.search(goal):
+            continue  # HSK 목표는 급수별 신규 어휘 수로 표시
+        if any(k in turn_text for k in _goal_keywords(goal)):
+            progress['goal_hits'][goal] = progress['goal_hits'].get(goal, 0) + 1
+
+def _goal_progress_text(progress, goal):
+    m = _GOAL_HSK_RE.search(goal)
+    if m:
+        return f"HSK {m.group(1)}급 어휘 {progress['hsk'].get(m.group(1), 0)}개"
+    return f"관련 턴 {progress['goal_hits'].get(goal, 0)}회"
+
+# ==================== 학습자 어휘 인덱스 ====================
+KNOWN_WORD_MASTERY = 3   # 이 횟수(턴) 이상 분석된 단어는 숙지한 것으로 보고 재설명 생략
+KNOWN_WORD_MAX_LEN = 4   # 발화에서 후보로 잘라볼 최대 단어 길이(한자 수)
+KNOWN_VOCAB_CACHE_SIZE = 256   # 메모리에 둘 학습자 수. 밀려난 학습자는 파일에서 다시 읽는다
+KNOWN_VOCAB_CACHE_TTL = 3600   # 초
+_HAN_RUN_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+
+class KnownVocab:
+    """학습자별 누적 어휘. 정렬된 단어 배열 + 등장 횟수 + 캐시된 어휘 노트를 JSON 파일로 보관."""
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._words = []     # 정렬된 단어 배열
+        self._counts = []    # _words와 같은 순서의 등장 턴 수
+        self._entries = {}   # 단어 -> 정규화된 어휘 노트
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self._path, encoding='utf-8') as f:
+                data = json.load(f)
+            self._words = list(data.get('words', []))
+            self._counts = list(data.get('counts', []))
+            self._entries = dict(data.get('entries', {}))
+        except Exception:
+            pass
+
+    def _count(self, word):
+        i = bisect.bisect_left(self._words, word)
+        if i < len(self._words) and self._words[i] == word:
+            return self._counts[i]
+        return 0
+
+    def _segment(self, run):
+        """기록된 단어로 최장 일치 분할. 어느 단어에도 속하지 않는 글자는 None."""
+        segments = []
+        i = 0
+        while i < len(run):
+            for n in range(min(KNOWN_WORD_MAX_LEN, len(run) - i), 0, -1):
+                if self._count(run[i:i + n]):
+                    segments.append(run[i:i + n])
+                    i += n
+                    break
+            else:
+                segments.append(None)
+                i += 1
+        return segments
+
+    def mastered_in(self, text):
+        """text에 등장하는 숙지 단어의 캐시 노트 목록.
+
+        더 긴 단어가 덮은 글자는 다시 보지 않고, 한 글자 단어는 양옆이 모르는 글자이면
+        더 긴 미기록 단어의 일부(大学生의 学)일 수 있으므로 제외한다.
+        """
+        found = {}
+        with self._lock:
+            for run in _HAN_RUN_RE.findall(text or ""):
+                segments = self._segment(run)
+                for k, word in enumerate(segments):
+                    if word is None or word in found or word not in self._entries:
+                        continue
+                    if self._count(word) < KNOWN_WORD_MASTERY:
+                        continue
+                    if len(word) == 1 and ((k > 0 and segments[k - 1] is None)
+                                           or (k + 1 < len(segments) and segments[k + 1] is None)):
+                        continue
+                    found[word] = self._entries[word]
+        return list(found.values())
+
+    def record(self, vocabulary):
+        """한 턴의 어휘를 반영하고 파일에 저장. 새로 분석된 노트는 캐시를 갱신한다.
+
+        캐시에서 합쳐 넣은 known=True 항목은 분석기가 돌려준 것이 아니므로 세지 않는다.
+        캐시에서 밀려난 뒤 같은 학습자의 인스턴스가 새로 생길 수 있어, 파일을 다시 읽고 반영한다.
+        """
+        with self._lock:
+            self._load()
+            for v in vocabulary:
+                word = v.get('word')
+                if not word or v.get('known'):
+                    continue
+                i = bisect.bisect_left(self._words, word)
+                if i < len(self._words) and self._words[i] == word:
+                    self._counts[i] += 1
+                else:
+                    self._words.insert(i, word)
+                    self._counts.insert(i, 1)
+                self._entries[word] = {k: val for k, val in v.items() if k != 'known'}
+            self._save()
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            tmp = self._path + ".tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'words': self._words, 'counts': self._counts, 'entries': self._entries}, f, ensure_ascii=False)
+            os.replace(tmp, self._path)
+        except OSError:
+            pass
+
+@st.cache_resource(max_entries=KNOWN_VOCAB_CACHE_SIZE, ttl=KNOWN_VOCAB_CACHE_TTL)
+def _get_known_vocab(learner_id):
+    # 대화에서 추출한 이름은 학습자 식별에 쓰지 않는다(미기재·동명이인이 한 파일을 공유하게 됨)
+    return KnownVocab(os.path.join(TUTOR_DATA_DIR, "known_vocab", f"{learner_id}.json"))
+
+# ==================== 백그라운드 턴 워커 ====================
+TURN_POLL_INTERVAL = 0.3  # 응답·분석 대기 중 상태 확인 주기(초)
+WORKER_IDLE_CHECK = 30    # 큐가 비어 있을 때 세션 종료 여부를 확인하는 주기(초)
+
+def _session_alive_check():
+    """현재 세션이 아직 열려 있는지 돌려주는 함수. 런타임 API를 쓸 수 없으면 항상 True."""
+    try:
+        from streamlit.runtime import get_instance
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        runtime = get_instance()
+        session_id = get_script_run_ctx().session_id
+    except Exception:
+        return lambda: True
+    return lambda: runtime.is_active_session(session_id)
+
+class TurnWorker:
+    """세션별 턴 처리 스레드.
+
+    학습자 메시지를 큐에 받아 순서대로 튜터 응답을 생성한다. 상세 분석은 AnalysisQueue가 따로 처리.
+    스레드에서는 st.session_state에 접근하지 않고, 결과는 drain()으로 메인 스크립트가 가져간다.
+    """
+
+    def __init__(self, user_name=None, alive=None, history=None, ids=None):
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._lock = threading.Lock()
+        self._ids = ids or itertools.count(1)
+        self._epoch = 0
+        self._cancel = threading.Event()      # 현재 epoch의 취소 신호
+        self._pending = []                    # [(job_id, text)] 대기 + 처리 중
+        self._running = None
+        self._history = list(history or [])
+        self._user_name = user_name
+        self._alive = alive or (lambda: True)  # 세션 종료 시 False → 스레드 종료
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="turn-worker", daemon=True)
+        self._thread.start()
+
+    # ---------- 메인 스크립트 측 ----------
+    def submit(self, text, language, goals):
+        with self._lock:
+            job_id = next(self._ids)
+            self._pending.append((job_id, text))
+            job = {
+                'id': job_id, 'epoch': self._epoch, 'cancel': self._cancel,
+                'text': text, 'language': language, 'goals': list(goals),
+            }
+        self._jobs.put(job)
+        return job_id
+
+    def cancel_all(self):
+        """대기 중인 턴을 버리고 진행 중인 호출을 중단한다. 대화 기록도 초기화."""
+        with self._lock:
+            self._epoch += 1
+            self._cancel.set()
+            self._cancel = threading.Event()
+            self._pending = []
+            self._history = []
+            _drain_queue(self._jobs)
+            _drain_queue(self._results)
+
+    def shutdown(self):
+        """진행 중인 호출을 중단하고 스레드를 끝낸다."""
+        with self._lock:
+            self._stop.set()
+            self._cancel.set()
+        self._jobs.put(None)
+
+    def is_alive(self):
+        return self._thread.is_alive() and not self._stop.is_set()
+
+    def respawn(self, history, language, goals):
+        """스레드가 멈춘 워커를 대신할 새 워커. 턴 번호를 이어 쓰고 처리 못 한 입력을 다시 넣는다."""
+        with self._lock:
+            pending = [text for _, text in self._pending]
+            worker = TurnWorker(user_name=self._user_name, alive=self._alive, history=history, ids=self._ids)
+        for text in pending:
+            worker.submit(text, language, goals)
+        return worker
+
+    def drain(self):
+        """완료된 턴과 현재 상태를 한 번에 가져온다. 따로 읽으면 그 사이 끝난 턴이 상태에서 빠진다."""
+        with self._lock:
+            results = [res for res in _drain_queue(self._results) if res['epoch'] == self._epoch]
+            return results, self._status()
+
+    def status(self):
+        with self._lock:
+            return self._status()
+
+    def _status(self):
+        return {
+            'state': 'running' if self._running is not None else ('queued' if self._pending else 'idle'),
+            'pending': [text for _, text in self._pending],
+        }
+
+    # ---------- 스레드 측 ----------
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self._jobs.get(timeout=WORKER_IDLE_CHECK)
+            except queue.Empty:
+                if not self._alive():
+                    self.shutdown()
+                continue
+            if job is None:
+                break
+            with self._lock:
+                if job['epoch'] != self._epoch:
+                    continue
+                self._running = job['id']
+            try:
+                self._process(job)
+            finally:
+                with self._lock:
+                    self._running = None
+                    self._pending = [p for p in self._pending if p[0] != job['id']]
+
+    def _process(self, job):
+        cancel = job['cancel'].is_set
+        user_msg = job['text']
+        user_name = None
+        failed = False
+        try:
+            if self._user_name is None:
+                try:
+                    user_name = extract_user_name_from_message(user_msg, cancel=cancel) or None
+                except TurnCancelled:
+                    raise
+                except Exception:
+                    pass
+            with self._lock:
+                if user_name:
+                    self._user_name = user_name
+                known_name = self._user_name
+                hist = self._history + [{'role': 'user', 'content': user_msg}]
+            reply_text = generate_assistant_reply(
+                user_msg, hist, job['goals'], known_name, language=job['language'], cancel=cancel
+            ) or "확인 불가"
+        except TurnCancelled:
+            return
+        except Exception as e:
+            reply_text = f"[오류] LLM 호출 실패: {e}"
+            failed = True  # 실패한 응답은 분석하지 않음
+
+        with self._lock:
+            if job['epoch'] != self._epoch:
+                return
+            self._history += [{'role': 'user', 'content': user_msg}, {'role': 'assistant', 'content': reply_text}]
+            self._results.put({
+                'epoch': job['epoch'], 'id': job['id'], 'user': user_msg, 'reply': reply_text,
+                'user_name': user_name, 'failed': failed,
+            })
+            self._pending = [p for p in self._pending if p[0] != job['id']]
+            self._running = None
+
+def _drain_queue(q):
+    out = []
+    while True:
+        try:
+            out.append(q.get_nowait())
+        except queue.Empty:
+            return out
+
+# ==================== 상세 분석 작업 큐 ====================
+ANALYSIS_PRIORITY_VISIBLE = 0      # 분석 패널에서 보고 있는 메시지
+ANALYSIS_PRIORITY_BACKGROUND = 1   # 응답 직후 등록되는 기본 작업(최근 메시지부터)
+
+class AnalysisQueue:
+    """세션별 상세 분석 작업 스레드.
+
+    튜터 메시지(turn_id)마다 분석 작업을 두고 pending → running → ready/failed로 진행한다.
+    응답 표시 후 등록되며, 패널에서 보고 있는 메시지는 prioritize()로 앞당긴다.
+    """
+
+    def __init__(self, alive=None):
+        self._heap = queue.PriorityQueue()   # (priority, -seq, turn_id, epoch)
+        self._results = queue.Queue()
+        self._lock = threading.Lock()
+        self._seq = itertools.count(1)
+        self._epoch = 0
+        self._cancel = threading.Event()
+        self._jobs = {}                      # turn_id -> 작업
+        self._alive = alive or (lambda: True)  # 세션 종료 시 False → 스레드 종료
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="analysis-worker", daemon=True)
+        self._thread.start()
+
+    # ---------- 메인 스크립트 측 ----------
+    def enqueue(self, turn_id, reply_text, user_msg, known_vocab=None, priority=ANALYSIS_PRIORITY_BACKGROUND):
+        with self._lock:
+            self._jobs[turn_id] = {
+                'state': 'pending', 'priority': priority, 'reply': reply_text,
+                'user': user_msg, 'known_vocab': known_vocab,
+            }
+            self._heap.put((priority, -next(self._seq), turn_id, self._epoch))
+
+    def prioritize(self, turn_id):
+        with self._lock:
+            job = self._jobs.get(turn_id)
+            if job is None or job['state'] != 'pending' or job['priority'] <= ANALYSIS_PRIORITY_VISIBLE:
+                return
+            job['priority'] = ANALYSIS_PRIORITY_VISIBLE
+            # 기존 항목은 큐에 남지만 꺼낼 때 우선순위가 달라 건너뛴다
+            self._heap.put((ANALYSIS_PRIORITY_VISIBLE, -next(self._seq), turn_id, self._epoch))
+
+    def cancel_all(self):
+        """대기 중인 분석을 버리고 진행 중인 호출을 중단한다."""
+        with self._lock:
+            self._epoch += 1
+            self._cancel.set()
+            self._cancel = threading.Event()
+            self._jobs = {}
+            _drain_queue(self._heap)
+            _drain_queue(self._results)
+
+    def shutdown(self):
+        """진행 중인 분석을 중단하고 스레드를 끝낸다."""
+        with self._lock:
+            self._stop.set()
+            self._cancel.set()
+        self._heap.put((-1, 0, None, None))  # 종료 신호: 어떤 작업보다 먼저 꺼내진다
+
+    def is_alive(self):
+        return self._thread.is_alive() and not self._stop.is_set()
+
+    def drain(self):
+        """완료된 분석과 작업별 현재 상태를 한 번에 가져온다."""
+        with self._lock:
+            results = [res for res in _drain_queue(self._results) if res['epoch'] == self._epoch]
+            return results, {turn_id: job['state'] for turn_id, job in self._jobs.items()}
+
+    # ---------- 스레드 측 ----------
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                priority, _, turn_id, epoch = self._heap.get(timeout=WORKER_IDLE_CHECK)
+            except queue.Empty:
+                if not self._alive():
+                    self.shutdown()
+                continue
+            if turn_id is None:
+                break
+            with self._lock:
+                job = self._jobs.get(turn_id)
+                if epoch != self._epoch or job is None or job['state'] != 'pending' or job['priority'] != priority:
+                    continue
+                job['state'] = 'running'
+                cancel = self._cancel.is_set
+            error = None
+            try:
+                analysis = analyze_assistant_output(job['reply'], known_vocab=job['known_vocab'], cancel=cancel)
+                analysis['feedback'] = generate_user_feedback(job['user'], cancel=cancel)
+                state = 'ready'
+            except TurnCancelled:
+                continue
+            except Exception as e:
+                analysis, error, state = None, str(e), 'failed'
+            with self._lock:
+                if epoch != self._epoch:
+                    continue
+                job['state'] = state
+                self._results.put({
+                    'epoch': epoch, 'id': turn_id, 'state': state, 'analysis': analysis, 'error': error,
+                    'known_vocab': job['known_vocab'],
+                })
+
+def _get_turn_worker():
+    worker = st.session_state.turn_worker
+    if worker is None:
+        st.session_state.turn_worker = TurnWorker(user_name=st.session_state.user_name, alive=_session_alive_check())
+    elif not worker.is_alive():
+        # 연결이 잠시 끊긴 동안 스레드가 멈췄다가 같은 세션으로 재연결된 경우
+        st.session_state.turn_worker = worker.respawn(
+            _history_for_anthropic(st.session_state.messages),
+            st.session_state.selected_language, st.session_state.goals,
+        )
+    return st.session_state.turn_worker
+
+def _get_analysis_queue():
+    analysis_queue = st.session_state.analysis_queue
+    if analysis_queue is None or not analysis_queue.is_alive():
+        # 처음 만들 때, 또는 재연결로 스레드가 멈춘 큐를 대신할 때: 끝나지 않은 분석을 다시 등록
+        st.session_state.analysis_queue = AnalysisQueue(alive=_session_alive_check())
+        for turn_id, entry in list(st.session_state.analyses.items()):
+            if entry['state'] in ('pending', 'running'):
+                _enqueue_analysis(turn_id)
+    return st.session_state.analysis_queue
+
+def _cancel_turns():
+    """대기·진행 중인 턴과 분석을 모두 취소 (언어 변경, 대화 삭제 시)."""
+    if st.session_state.turn_worker is not None:
+        st.session_state.turn_worker.cancel_all()
+    if st.session_state.analysis_queue is not None:
+        st.session_state.analysis_queue.cancel_all()
+    st.session_state.analyses = {}
+    st.session_state.turn_status = {'state': 'idle', 'pending': [], 'analyzing': False}
+
+def _message_position(turn_id):
+    return next((i for i in range(len(st.session_state.messages) - 1, -1, -1)
+                 if st.session_state.messages[i].get('turn_id') == turn_id), None)
+
+def _enqueue_analysis(turn_id, priority=ANALYSIS_PRIORITY_BACKGROUND):
+    position = _message_position(turn_id)
+    if position is None:
+        return
+    user_msg = st.session_state.messages[position - 1]['content'] if position > 0 else ""
+    st.session_state.analyses[turn_id] = {'state': 'pending', 'analysis': None, 'error': None}
+    # 큐가 멈춰 있으면 pending으로만 남겨 두고, _get_analysis_queue()가 새 큐를 만들 때 등록된다
+    analysis_queue = st.session_state.analysis_queue
+    if analysis_queue is not None and analysis_queue.is_alive():
+        analysis_queue.enqueue(
+            turn_id, st.session_state.messages[position]['content'], user_msg,
+            known_vocab=_get_known_vocab(st.session_state.learner_id), priority=priority,
+        )
+
+# 워커가 끝낸 턴을 세션 상태에 반영하고, 중국어면 분석 작업을 등록
+if st.session_state.turn_worker is not None:
+    turn_results, turn_status = st.session_state.turn_worker.drain()
+    for res in turn_results:
+        st.session_state.messages.append({'role': 'user', 'content': res['user']})
+        st.session_state.messages.append({'role': 'assistant', 'content': res['reply'], 'turn_id': res['id']})
+        _index_text(len(st.session_state.messages) - 2, 'user', res['user'])
+        _index_text(len(st.session_state.messages) - 1, 'assistant', res['reply'])
+        if res['user_name'] and st.session_state.user_name is None:
+            st.session_state.user_name = res['user_name']
+        if st.session_state.selected_language == 'chinese' and not res['failed']:
+            _enqueue_analysis(res['id'])
+    st.session_state.turn_status = dict(turn_status, analyzing=False)
+
+# 완료된 분석을 메시지별로 보관하고 진도·어휘 인덱스·검색 인덱스에 반영
+if st.session_state.analysis_queue is not None:
+    analysis_results, live_states = st.session_state.analysis_queue.drain()
+    for res in analysis_results:
+        st.session_state.analyses[res['id']] = {'state': res['state'], 'analysis': res['analysis'], 'error': res['error']}
+        if res['state'] != 'ready':
+            continue
+        # 분석 요청 때 쓴 것과 같은 인덱스에 기록
+        if res['known_vocab'] is not None:
+            res['known_vocab'].record(res['analysis'].get('vocabulary', []))
+        if st.session_state.progress is None:
+            st.session_state.progress = _new_progress()
+        _fold_turn_progress(st.session_state.progress, res['analysis'], st.session_state.goals)
+        position = _message_position(res['id'])
+        if position is not None:
+            _index_vocabulary(position, res['analysis'])
+    for turn_id, entry in st.session_state.analyses.items():
+        if entry['state'] in ('pending', 'running') and live_states.get(turn_id) in ('pending', 'running'):
+            entry['state'] = live_states[turn_id]
+    st.session_state.turn_status['analyzing'] = any(
+        a['state'] in ('pending', 'running') for a in st.session_state.analyses.values()
+    )
 
 # ==================== 언어 및 목표 ====================
 languages = {
@@ -271,11 +934,13 @@ with st.sidebar:
         key='lang_select'
     )
     if selected_lang != st.session_state.selected_language:
+        _cancel_turns()
+        _new_conversation()
         st.session_state.selected_language = selected_lang
         st.session_state.messages = []
-        st.session_state.detailed_analysis = None
         st.session_state.show_translation = {}
         st.session_state.goals = []
+        st.session_state.progress = None
         initialize_goals()
         st.rerun()
 
@@ -303,7 +968,46 @@ with st.sidebar:
             st.session_state.goals.append(new_goal_input.strip())
             st.rerun()
 
+    progress = st.session_state.progress
+    if progress and progress['turns']:
+        st.markdown("---")
+        st.markdown("### 📈 학습 진도")
+        col1, col2, col3 = st.columns(3)
+        col1.metric("분석 턴", progress['turns'])
+        col2.metric("새 단어", progress['new_words'])
+        col3.metric("반복 단어", progress['repeated_words'])
+        for goal in st.session_state.goals:
+            st.caption(f"🎯 {goal}: {_goal_progress_text(progress, goal)}")
+        if progress['hsk']:
+            levels = sorted(progress['hsk'], key=lambda k: (k == '?', k))
+            st.caption("HSK 급수별 어휘: " + " · ".join(
+                f"{'미상' if k == '?' else k + '급'} {progress['hsk'][k]}" for k in levels))
+        if progress['errors']:
+            errors = sorted(progress['errors'].items(), key=lambda kv: kv[1], reverse=True)
+            st.caption("오류 유형: " + " · ".join(f"{k} {n}" for k, n in errors))
+
     st.markdown("---")
+    st.markdown("### 🔍 대화 검색")
+    search_query = st.text_input("검색어", key="search_input", placeholder="예: 虽然 但是, 学习, 번역문...")
+    if search_query.strip():
+        field_kr = {'user': '학습자', 'assistant': '튜터', 'translation': '번역', 'vocabulary': '어휘'}
+        hits = _get_search_index().search(search_query, st.session_state.conversation_ids)
+        if not hits:
+            st.caption("검색 결과 없음")
+        for hit in hits:
+            where = f"#{hit['position'] + 1}" if hit['conversation'] == st.session_state.conversation_id else "이전 대화"
+            snippet = hit['text'] if len(hit['text']) <= 80 else hit['text'][:80] + "…"
+            st.markdown(f"**{where} · {field_kr.get(hit['field'], hit['field'])}** ({hit['matched']}/{hit['total']})  \n{snippet}")
+
+    st.markdown("---")
+    clear_disabled = len(st.session_state.messages) == 0 and not st.session_state.turn_status['pending']
+    if st.button("🗑️ 대화 지우기", type="primary", disabled=clear_disabled, use_container_width=True, key='clear_btn'):
+        _cancel_turns()
+        _new_conversation()
+        st.session_state.messages = []
+        st.session_state.show_translation = {}
+        st.rerun()
+
     save_disabled = len(st.session_state.messages) == 0
     if st.button("💾 대화 저장", type="primary", disabled=save_disabled, use_container_width=True, key='save_btn'):
         text_content = f"언어 학습 기록\n언어: {current_lang['name']}\n숙련도: {proficiency_kr}\n날짜: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
@@ -324,7 +1028,7 @@ with st.sidebar:
 st.markdown("""
 <style>
 /* --- 추가한 CSS --- */
-button[key="save_btn"] {
+button[key="save_btn"], button[key="clear_btn"] {
     border-radius: 0.375rem !important;
     width: 100% !important;
     height: auto !important;
@@ -337,7 +1041,7 @@ button[key="save_btn"] {
 # ==================== 메시지 표시 ====================
 st.markdown('<div class="messages-container">', unsafe_allow_html=True)
 
-if len(st.session_state.messages) == 0:
+if len(st.session_state.messages) == 0 and not st.session_state.turn_status['pending']:
     st.markdown(f"""
     <div class="empty-state">
         <div class="empty-icon">{current_lang['flag']}</div>
@@ -375,7 +1079,11 @@ else:
                     st.rerun()
             st.markdown('<div style="clear:both;"></div>', unsafe_allow_html=True)
 
-    if st.session_state.is_loading:
+    # 응답 대기 중인 메시지(입력 순서대로 처리됨)
+    for text in st.session_state.turn_status['pending']:
+        st.markdown(f'<div class="user-message pending">{text}</div><div style="clear:both;"></div>', unsafe_allow_html=True)
+
+    if st.session_state.turn_status['state'] != 'idle':
         st.markdown("""
         <div class="loading-message">
             <div class="loading-dots">
@@ -396,11 +1104,10 @@ with col_input:
         "message",
         placeholder=f"{current_lang['name']}로 입력...",
         key=f"user_input_{st.session_state.input_key}",
-        label_visibility="collapsed",
-        disabled=st.session_state.is_loading
+        label_visibility="collapsed"
     )
 with col_button:
-    send_button = st.button("↑", type="primary", disabled=st.session_state.is_loading or not user_input.strip(), key="send_btn")
+    send_button = st.button("↑", type="primary", disabled=not user_input.strip(), key="send_btn")
 
 # ==================== LLM 유틸 ====================
 def _build_tutor_system_prompt(target_lang: str):
@@ -416,20 +1123,21 @@ def _build_tutor_system_prompt(target_lang: str):
         "- 친절한 친구와 같은 말투로 대화할 것.\n"
     )
 
-def _history_for_anthropic():
+def _history_for_anthropic(messages):
     hist = []
-    for m in st.session_state.messages:
+    for m in messages:
         role = "user" if m['role'] == 'user' else "assistant"
         hist.append({"role": role, "content": m['content']})
     return hist
 
-def generate_assistant_reply(user_msg: str):
-    is_first_turn = sum(1 for m in st.session_state.messages if m['role'] == 'assistant') == 0
-    goals_text = ", ".join(st.session_state.goals) if st.session_state.goals else "기초 회화"
-    system_prompt = _build_tutor_system_prompt(st.session_state.selected_language)
-    hist = _history_for_anthropic()
+def generate_assistant_reply(user_msg: str, messages, goals, user_name=None, language=None, cancel=None):
+    # 워커 스레드에서 호출되므로 세션 상태 대신 인자로 받은 대화 기록/목표를 사용
+    is_first_turn = sum(1 for m in messages if m['role'] == 'assistant') == 0
+    goals_text = ", ".join(goals) if goals else "기초 회화"
+    system_prompt = _build_tutor_system_prompt(language)
+    hist = _history_for_anthropic(messages)
 
-    user_name = st.session_state.user_name or ""
+    user_name = user_name or ""
     name_clause = f"저장된 사용자 이름: {user_name}" if user_name else "사용자 이름 미저장"
 
     if is_first_turn:
@@ -448,9 +1156,9 @@ def generate_assistant_reply(user_msg: str):
         )
 
     messages = hist + [{"role": "user", "content": user_instruction}]
-    return _claude(messages=messages, system=system_prompt, max_tokens=600, temperature=0)
+    return _claude(messages=messages, system=system_prompt, max_tokens=600, temperature=0, cancel=cancel)
 
-def extract_user_name_from_message(latest_user_msg: str) -> str:
+def extract_user_name_from_message(latest_user_msg: str, cancel=None) -> str:
     system_prompt = (
         "역할: 정보 추출기.\n"
         "규칙: 입력 문장에서 스스로 밝힌 이름만 한국어 표기 그대로 추출. "
@@ -461,7 +1169,7 @@ def extract_user_name_from_message(latest_user_msg: str) -> str:
         f"문장: {latest_user_msg}\n"
         "형식: {\"name\": \"...\"} 또는 {\"name\": \"\"}"
     )
-    raw = _claude(messages=[{"role":"user","content":user_prompt}], system=system_prompt, max_tokens=100, temperature=0)
+    raw = _claude(messages=[{"role":"user","content":user_prompt}], system=system_prompt, max_tokens=100, temperature=0, cancel=cancel)
     try:
         data = json.loads(raw)
         name = (data.get("name") or "").strip()
@@ -495,10 +1203,13 @@ def _normalize_grammar_list(raw):
             })
     return out
 
-def _normalize_vocab_list(raw):
+def _normalize_vocab_list(raw, known_entries=None):
+    # known_entries: 분석 요청에서 제외한 숙지 단어의 캐시 노트. 결과 끝에 known=True로 합친다.
     out = []
+    known_entries = known_entries or []
+    known_words = {k.get("word") for k in known_entries}
     if not isinstance(raw, list):
-        return out
+        raw = []
     for v in raw:
         if isinstance(v, dict):
             out.append({
@@ -509,17 +1220,21 @@ def _normalize_vocab_list(raw):
                 "meaning_ko": v.get("meaning_ko") or "확인 불가",
                 "synonyms": v.get("synonyms") or [],
                 "collocations": v.get("collocations") or [],
-                "example": v.get("example") or {}
+                "example": v.get("example") or {},
+                "known": bool(v.get("known"))
             })
         elif isinstance(v, str):
             out.append({
                 "word": v, "pinyin": "", "pos": "확인 불가", "hsk_level": "확인 불가",
-                "meaning_ko": "확인 불가", "synonyms": [], "collocations": [], "example": {}
+                "meaning_ko": "확인 불가", "synonyms": [], "collocations": [], "example": {}, "known": False
             })
+    out = [v for v in out if v["word"] not in known_words]
+    for k in known_entries:
+        out.append(dict(_normalize_vocab_list([k])[0], known=True))
     return out
 
 # -------- 상세분석(튜터 발화 기준) & 사용자 피드백(학습자 발화 기준) ----------
-def analyze_assistant_output(assistant_text: str):
+def analyze_assistant_output(assistant_text: str, known_vocab=None, cancel=None):
     system_prompt = (
         "역할: 중국어 학습 분석기.\n"
         "출력: 반드시 JSON만 출력.\n"
@@ -530,24 +1245,33 @@ def analyze_assistant_output(assistant_text: str):
         "- notes: 한국어 3~5문장 요약/학습팁\n"
         "불확실하면 '확인 불가' 명시."
     )
+    # 학습자가 이미 숙지한 단어는 vocabulary에서 빼도록 요청하고, 캐시된 노트를 합쳐서 돌려준다
+    known_entries = known_vocab.mastered_in(assistant_text) if known_vocab is not None else []
+    known_clause = ""
+    if known_entries:
+        known_clause = (
+            "다음 단어는 학습자가 이미 숙지했으므로 vocabulary에서 제외하라: "
+            + ", ".join(k["word"] for k in known_entries) + "\n"
+        )
     user_prompt = (
         "다음 텍스트를 분석하라. 대상은 튜터의 중국어 발화다.\n"
         f"[튜터 발화]\n{assistant_text}\n"
+        f"{known_clause}"
         "형식은 JSON만 반환."
     )
-    raw = _claude(messages=[{"role":"user","content":user_prompt}], system=system_prompt, max_tokens=1100, temperature=0)
+    raw = _claude(messages=[{"role":"user","content":user_prompt}], system=system_prompt, max_tokens=1100, temperature=0, cancel=cancel)
     try:
         data = json.loads(raw)
         return {
             "pinyin": data.get("pinyin",""),
             "grammar": _normalize_grammar_list(data.get("grammar", [])),
-            "vocabulary": _normalize_vocab_list(data.get("vocabulary", [])),
+            "vocabulary": _normalize_vocab_list(data.get("vocabulary", []), known_entries),
             "notes": data.get("notes","")
         }
     except Exception:
-        return {"pinyin":"확인 불가","grammar":[],"vocabulary":[],"notes":"확인 불가"}
+        return {"pinyin":"확인 불가","grammar":[],"vocabulary":_normalize_vocab_list([], known_entries),"notes":"확인 불가"}
 
-def generate_user_feedback(user_msg: str):
+def generate_user_feedback(user_msg: str, cancel=None):
     system_prompt = (
         "역할: 중국어 학습 피드백 생성기.\n"
         "출력: 반드시 JSON만 출력.\n"
@@ -559,7 +1283,7 @@ def generate_user_feedback(user_msg: str):
         f"[학습자 발화]\n{user_msg}\n"
         "형식은 JSON만."
     )
-    raw = _claude(messages=[{"role":"user","content":user_prompt}], system=system_prompt, max_tokens=700, temperature=0)
+    raw = _claude(messages=[{"role":"user","content":user_prompt}], system=system_prompt, max_tokens=700, temperature=0, cancel=cancel)
     try:
         data = json.loads(raw)
         return data.get("feedback", {})
@@ -582,9 +1306,34 @@ def translate_to_korean(text: str, source_hint: str = ""):
     return _claude(messages=[{"role":"user","content":user_prompt}], system=system_prompt, max_tokens=400, temperature=0)
 
 # ==================== 상세 분석 렌더링 ====================
-if st.session_state.selected_language == 'chinese' and st.session_state.detailed_analysis:
-    with st.expander("📚 상세 분석", expanded=st.session_state.show_analysis):
-        analysis = st.session_state.detailed_analysis
+analysis = None
+if st.session_state.selected_language == 'chinese' and st.session_state.analyses:
+    # st.expander는 펼침 여부를 알려주지 않으므로 토글로 열고, 열려 있는 동안 선택한 메시지의 분석을 우선 처리
+    st.toggle("📚 상세 분석", key='show_analysis')
+    if st.session_state.show_analysis:
+        positions = {m['turn_id']: i for i, m in enumerate(st.session_state.messages)
+                     if m.get('turn_id') in st.session_state.analyses}
+        turn_ids = sorted(positions, key=positions.get, reverse=True)
+        selected_turn = st.selectbox(
+            "분석할 메시지",
+            options=turn_ids,
+            format_func=lambda t: f"#{positions[t] + 1} {st.session_state.messages[positions[t]]['content'][:20]}",
+            key='analysis_select'
+        )
+        entry = st.session_state.analyses[selected_turn]
+        if entry['state'] in ('pending', 'running'):
+            _get_analysis_queue().prioritize(selected_turn)
+            st.caption("분석 중..." if entry['state'] == 'running' else "분석 대기 중...")
+        elif entry['state'] == 'failed':
+            st.caption(f"분석 실패: {entry['error']}")
+            if st.button("↻", type="primary", key="retry_analysis", help="다시 분석"):
+                _enqueue_analysis(selected_turn, priority=ANALYSIS_PRIORITY_VISIBLE)
+                st.rerun()
+        else:
+            analysis = entry['analysis']
+
+if analysis:
+    with st.container():
 
         # 병음
         pinyin = analysis.get("pinyin")
@@ -656,6 +1405,8 @@ if st.session_state.selected_language == 'chinese' and st.session_state.detailed
               <div class="vocabulary-box">
             """
             for v in vocab_list:
+                if v.get("known"):
+                    continue
                 vocab_html += (
                     f"<div style='margin-bottom:0.5rem;'>"
                     f"<strong>{v.get('word','')}</strong> ({v.get('pinyin','')}) — {v.get('pos','')} / HSK {v.get('hsk_level','확인 불가')}<br>"
@@ -671,6 +1422,12 @@ if st.session_state.selected_language == 'chinese' and st.session_state.detailed
                 if ex:
                     vocab_html += f"<div>예문: {ex.get('cn','')} <span style='color:#888'>({ex.get('pinyin','')})</span> — {ex.get('ko','')}</div>"
                 vocab_html += "</div>"
+            # 이미 숙지한 단어는 캐시된 노트로 한 줄 요약
+            known = [v for v in vocab_list if v.get("known")]
+            if known:
+                vocab_html += "<div style='color:#666;'>이미 아는 단어: " + " · ".join(
+                    f"{v.get('word','')} ({v.get('pinyin','')}) {v.get('meaning_ko','')}" for v in known
+                ) + "</div>"
             vocab_html += "</div></div>"
             st.markdown(vocab_html, unsafe_allow_html=True)
 
@@ -729,6 +1486,7 @@ if st.session_state.translating_message_id is not None:
             src_hint = "중국어" if st.session_state.selected_language == "chinese" else ""
             trans = translate_to_korean(msg['content'], src_hint)
             st.session_state.messages[idx]['translation'] = trans or "확인 불가"
+            _index_text(idx, 'translation', st.session_state.messages[idx]['translation'])
             st.session_state.show_translation[idx] = True
         except Exception as e:
             st.session_state.messages[idx]['translation'] = f"[오류] 번역 실패: {e}"
@@ -738,36 +1496,20 @@ if st.session_state.translating_message_id is not None:
 
 # ==================== 전송 처리 ====================
 if send_button and user_input.strip():
-    st.session_state.messages.append({'role': 'user', 'content': user_input})
-    if st.session_state.user_name is None:
-        try:
-            cand = extract_user_name_from_message(user_input)
-            if cand:
-                st.session_state.user_name = cand
-        except Exception:
-            pass
-    st.session_state.is_loading = True
+    # 응답 생성 중에도 입력을 받아 큐에 쌓고, 워커가 순서대로 처리.
+    # 워커 스레드는 생성된 실행의 전역을 참조하므로 LLM 유틸이 모두 정의된 이곳에서 만든다.
+    _get_analysis_queue()
+    _get_turn_worker().submit(user_input, st.session_state.selected_language, st.session_state.goals)
+    st.session_state.turn_status = dict(st.session_state.turn_worker.status(), analyzing=st.session_state.turn_status['analyzing'])
     st.session_state.input_key += 1
     st.rerun()
 
-# ==================== LLM 응답 생성 ====================
-if st.session_state.is_loading and len(st.session_state.messages) > 0 and st.session_state.messages[-1]['role'] == 'user':
-    time.sleep(0.1)
-    user_msg = st.session_state.messages[-1]['content']
-    try:
-        reply_text = generate_assistant_reply(user_msg) or "확인 불가"
-        st.session_state.messages.append({'role': 'assistant', 'content': reply_text})
-
-        if st.session_state.selected_language == 'chinese':
-            analysis_core = analyze_assistant_output(reply_text)
-            analysis_core['feedback'] = generate_user_feedback(user_msg)
-            st.session_state.detailed_analysis = analysis_core
-        else:
-            st.session_state.detailed_analysis = None
-
-    except Exception as e:
-        st.session_state.messages.append({'role': 'assistant','content': f"[오류] LLM 호출 실패: {e}"})
-        st.session_state.detailed_analysis = None
-
-    st.session_state.is_loading = False
+# ==================== 턴 상태 폴링 ====================
+# 재연결된 세션이면 멈춘 워커를 다시 띄운다 (워커 생성은 LLM 유틸이 모두 정의된 뒤에만)
+if st.session_state.turn_worker is not None:
+    _get_turn_worker()
+if st.session_state.analysis_queue is not None:
+    _get_analysis_queue()
+if st.session_state.turn_status['state'] != 'idle' or st.session_state.turn_status['analyzing']:
+    time.sleep(TURN_POLL_INTERVAL)
     st.rerun()